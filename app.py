@@ -1,23 +1,67 @@
 import os
 import json
+import math
+import socket
+import sys
+import functools
+import heapq
+import operator
 import time
 import threading
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from types import MappingProxyType
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
 import altair as alt
 import paho.mqtt.client as mqtt
+from readerwriterlock import rwlock
+from streamlit_autorefresh import st_autorefresh
 
 MQTT_BROKER = os.getenv("MQTT_BROKER")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "8883"))
 MQTT_USERNAME = os.getenv("MQTT_USERNAME")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
 EXPLAINER_HTTP_BASE = (os.getenv("EXPLAINER_HTTP_BASE") or "").rstrip("/")
+DEVICE_TTL_S = float(os.getenv("DEVICE_TTL_S", "86400"))
 NGROK_SKIP_WARNING = os.getenv("NGROK_SKIP_WARNING", "true").lower() in ("1", "true", "yes", "y")
 
 TOPICS = ["wmn/metrics/#", "wmn/analysis/#", "wmn/explain/#"]
+TOPIC_KINDS = frozenset(("metrics", "analysis", "explain"))
+
+RSSI_TH = np.array([-80.0, -70.0, -60.0])
+RSSI_PEN = np.array([35.0, 20.0, 8.0, 0.0])
+LAT_TH = np.array([60.0, 120.0, 200.0])
+LAT_PEN = np.array([0.0, 10.0, 25.0, 40.0])
+JIT_TH = np.array([15.0, 35.0, 60.0])
+JIT_PEN = np.array([0.0, 10.0, 20.0, 30.0])
+LOSS_TH = np.array([1.0, 3.0, 6.0])
+LOSS_PEN = np.array([0.0, 15.0, 30.0, 45.0])
+
+HIST_LEN = 1200
+INGEST_BATCH = 2048
+QA_PREVIEW_CHARS = 16384
+
+EMPTY = MappingProxyType({})
+
+HISTORY_FIELDS = {"metrics": ("lat_hist", "latency_ms_avg"), "analysis": ("score_hist", "wireless_score_0_100")}
+
+CMP = {"lt": operator.lt, "gt": operator.gt}
+
+# (type, column, op, bad factor, alert text, incident detail)
+ALERT_RULES = (
+    ("weak_signal", "rssi_dbm", "lt", None, "Weak signal: RSSI %.0f dBm", "RSSI %.0f dBm"),
+    ("high_latency", "latency_ms", "gt", 1.6, "High latency: %.1f ms", "Latency %.1f ms"),
+    ("high_jitter", "jitter_ms", "gt", 1.6, "High jitter: %.1f ms", "Jitter %.1f ms"),
+    ("packet_loss", "loss_pct", "gt", 2.0, "Packet loss: %.2f%%", "Loss %.2f%%"),
+)
 
 st.set_page_config(layout="wide", page_title="WMN Command Center")
 
@@ -33,6 +77,8 @@ h1 { letter-spacing: -0.03em; }
 .dot.warn { background:#fbbf24; }
 .dot.bad { background:#fb7185; }
 .card { border:1px solid rgba(255,255,255,0.10); background: rgba(255,255,255,0.02); border-radius:16px; padding:14px; }
+.kpis { display:grid; grid-template-columns: repeat(4, minmax(0, 1fr)); gap: 1rem; margin-bottom: 1rem; }
+@media (max-width: 640px) { .kpis { grid-template-columns: minmax(0, 1fr); } }
 .kpi { border:1px solid rgba(255,255,255,0.10); background: rgba(255,255,255,0.02); border-radius:16px; padding:14px; min-height: 92px; }
 .kpi .l { font-size:12px; opacity:0.55; }
 .kpi .v { font-size:24px; font-weight:800; margin-top:6px; letter-spacing:-0.02em; }
@@ -47,52 +93,146 @@ hr { border:none; border-top:1px solid rgba(255,255,255,0.08); margin: 16px 0; }
 def now_s() -> float:
     return time.time()
 
-def clamp(v: float, lo: float, hi: float) -> float:
-    return max(lo, min(hi, v))
-
 def safe_num(x):
-    return float(x) if isinstance(x, (int, float)) else None
+    if type(x) is not float:
+        if not isinstance(x, (int, float)):
+            return None
+        try:
+            x = float(x)
+        except OverflowError:
+            return None
+    return x if math.isfinite(x) else None
+
+def num_column(bodies: list, key: str) -> np.ndarray:
+    return np.array([safe_num(b.get(key)) for b in bodies], dtype=np.float64)
+
+def topic_kind(topic: str):
+    parts = topic.split("/", 2)
+    return parts[1] if len(parts) > 1 and parts[1] in TOPIC_KINDS else None
+
+def sub_dict(payload: dict, key: str):
+    v = payload.get(key)
+    return v if isinstance(v, dict) else EMPTY
+
+def _penalty(values, thresholds, penalties, side):
+    pen = penalties[np.searchsorted(thresholds, values, side=side)]
+    return np.where(np.isnan(values), 0.0, pen)
+
+def compute_scores(rssi, latency, jitter, loss):
+    pen = np.add.reduce((
+        _penalty(rssi, RSSI_TH, RSSI_PEN, "right"),
+        _penalty(latency, LAT_TH, LAT_PEN, "left"),
+        _penalty(jitter, JIT_TH, JIT_PEN, "left"),
+        _penalty(loss, LOSS_TH, LOSS_PEN, "left"),
+    ))
+    missing = np.isnan(rssi) & np.isnan(latency) & np.isnan(jitter) & np.isnan(loss)
+    return np.where(missing, np.nan, np.clip(100.0 - pen, 0, 100))
+
+class RingBuffer:
+    __slots__ = ("t", "v", "i", "n", "seq")
+
+    def __init__(self, size: int = HIST_LEN):
+        self.t = np.empty(size, dtype=np.float64)
+        self.v = np.empty(size, dtype=np.float32)
+        self.i = 0
+        self.n = 0
+        # clock-seeded so a ring re-created after eviction never reuses a cached (dev, seq) key
+        self.seq = time.monotonic_ns()
+
+    def __len__(self) -> int:
+        return self.n
+
+    def append(self, t: float, v: float):
+        self.t[self.i] = t
+        self.v[self.i] = v
+        self.i = (self.i + 1) % len(self.v)
+        self.n = min(self.n + 1, len(self.v))
+        self.seq += 1
+
+    def tail(self, k: int):
+        idx = np.arange(self.i - min(k, self.n), self.i) % len(self.v)
+        return self.t[idx], self.v[idx]
+
+def match_alert_rules(values, thresholds: dict):
+    hits = []
+    for kind, col, op, bad_factor, alert_fmt, detail_fmt in ALERT_RULES:
+        v = values.get(col)
+        if v is None or pd.isna(v) or not CMP[op](v, thresholds[col]):
+            continue
+        sev = "bad" if bad_factor is not None and CMP[op](v, thresholds[col] * bad_factor) else "warn"
+        hits.append((sev, kind, alert_fmt % v, detail_fmt % v))
+    return hits
+
+def chart_spec(chart: alt.Chart) -> dict:
+    spec = chart.to_dict()
+    spec.pop("data", None)
+    spec.pop("datasets", None)
+    return spec
+
+@functools.lru_cache(maxsize=None)
+def heatmap_spec() -> dict:
+    return chart_spec(
+        alt.Chart().mark_rect().encode(
+            x=alt.X("minute:T", title="Time"),
+            y=alt.Y("device:N", title="Device"),
+            color=alt.Color("lat:Q", title="Latency (ms)"),
+            tooltip=[alt.Tooltip("device:N"), alt.Tooltip("minute:T"), alt.Tooltip("lat:Q", format=".1f")],
+        ).properties(height=250)
+    )
 
-def compute_score(rssi, latency, jitter, loss):
-    if rssi is None and latency is None and jitter is None and loss is None:
-        return None
-    s = 100.0
-    if rssi is not None:
-        s -= 0 if rssi >= -60 else 8 if rssi >= -70 else 20 if rssi >= -80 else 35
-    if latency is not None:
-        s -= 0 if latency <= 60 else 10 if latency <= 120 else 25 if latency <= 200 else 40
-    if jitter is not None:
-        s -= 0 if jitter <= 15 else 10 if jitter <= 35 else 20 if jitter <= 60 else 30
-    if loss is not None:
-        s -= 0 if loss <= 1 else 15 if loss <= 3 else 30 if loss <= 6 else 45
-    return int(clamp(s, 0, 100))
-
-def sev_from_score(score):
-    if score is None:
-        return "unknown"
-    if score >= 85:
-        return "ok"
-    if score >= 70:
-        return "warn"
-    return "bad"
+@functools.lru_cache(maxsize=None)
+def health_hist_spec() -> dict:
+    return chart_spec(
+        alt.Chart().mark_bar(opacity=0.85).encode(
+            x=alt.X("health:Q", bin=alt.Bin(maxbins=20), title="Health (0-100)"),
+            y=alt.Y("count():Q", title="Devices"),
+            tooltip=[alt.Tooltip("count():Q", title="Devices")],
+        ).properties(height=250)
+    )
+
+@functools.lru_cache(maxsize=None)
+def count_bar_spec(field: str) -> dict:
+    return chart_spec(
+        alt.Chart().mark_bar(opacity=0.85).encode(
+            x=alt.X("size:Q", title="Count"),
+            y=alt.Y(f"{field}:N", sort="-x", title=""),
+            tooltip=[alt.Tooltip(f"{field}:N"), alt.Tooltip("size:Q")],
+        ).properties(height=260)
+    )
+
+@functools.lru_cache(maxsize=256)
+def kpi_html(label: str, value: str, hint: str) -> str:
+    return f'<div class="kpi"><div class="l">{label}</div><div class="v">{value}</div><div class="h">{hint}</div></div>'
 
 def dot_class(sev: str) -> str:
     return "dot ok" if sev == "ok" else "dot warn" if sev == "warn" else "dot bad" if sev == "bad" else "dot"
 
-def http_post_json(url: str, payload: dict, timeout_s: int = 30):
-    headers = {"Accept": "application/json"}
+@st.cache_resource
+def http_session() -> requests.Session:
+    s = requests.Session()
+    s.headers.update({"Accept": "application/json", "Content-Type": "application/json"})
     if NGROK_SKIP_WARNING:
-        headers["ngrok-skip-browser-warning"] = "true"
-    r = requests.post(url, json=payload, headers=headers, timeout=timeout_s)
+        s.headers["ngrok-skip-browser-warning"] = "true"
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+@st.cache_resource
+def http_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="wmn-explain")
+
+def http_post_json(url: str, payload: dict, timeout_s: int = 30):
+    r = http_session().post(url, data=orjson.dumps(payload), timeout=timeout_s)
     ctype = (r.headers.get("content-type") or "").lower()
     if "application/json" in ctype:
-        return r.status_code, r.json(), None
+        return r.status_code, orjson.loads(r.content), None
     text = (r.text or "").strip()
     return r.status_code, None, {"error": "Non-JSON response", "status_code": r.status_code, "content_type": ctype, "text_preview": text[:800]}
 
 @st.cache_resource
 def init_mqtt():
-    lock = threading.Lock()
+    lock = rwlock.RWLockFair()
     store = {
         "metrics": {},
         "analysis": {},
@@ -100,6 +240,7 @@ def init_mqtt():
         "lat_hist": {},
         "score_hist": {},
         "last_seen_by_device": {},
+        "devices": (),
         "connected": False,
         "last_msg_ts": 0.0,
         "events": deque(maxlen=3000),
@@ -110,55 +251,109 @@ def init_mqtt():
         return store
 
     def on_connect(client, userdata, flags, reason_code, properties):
-        with lock:
-            store["connected"] = True
-        for topic in TOPICS:
-            client.subscribe(topic)
+        store["connected"] = True
+        client.subscribe([(topic, 0) for topic in TOPICS])
+
+    # Telemetry floods drop their oldest frames; explanations are rare and get their own inbox.
+    inbox = deque(maxlen=50000)
+    explain_inbox = deque(maxlen=1000)
 
     def on_message(client, userdata, msg):
-        try:
-            payload = json.loads(msg.payload.decode("utf-8"))
-            device_id = payload.get("device_id", "unknown")
-            ts = now_s()
-
-            with lock:
-                store["last_msg_ts"] = ts
-                store["last_seen_by_device"][device_id] = ts
-                store["events"].appendleft({"ts": pd.Timestamp.utcnow(), "topic": msg.topic, "device": device_id})
-
-                if msg.topic.startswith("wmn/metrics"):
-                    store["metrics"][device_id] = payload
-                    mb = payload.get("metrics", {}) if isinstance(payload, dict) else {}
-                    lat = safe_num(mb.get("latency_ms_avg"))
-                    if lat is not None:
-                        dq = store["lat_hist"].setdefault(device_id, deque(maxlen=1200))
-                        dq.append({"t": pd.Timestamp.utcnow(), "lat": lat})
-
-                elif msg.topic.startswith("wmn/analysis"):
-                    store["analysis"][device_id] = payload
-                    ab = payload.get("analysis", {}) if isinstance(payload, dict) else {}
-                    sc = safe_num(ab.get("wireless_score_0_100"))
-                    if sc is not None:
-                        dq = store["score_hist"].setdefault(device_id, deque(maxlen=1200))
-                        dq.append({"t": pd.Timestamp.utcnow(), "score": float(sc)})
-
-                elif msg.topic.startswith("wmn/explain"):
-                    store["explain"][device_id] = payload
-
-        except Exception:
-            pass
+        (explain_inbox if msg.topic.startswith("wmn/explain") else inbox).append((msg.topic, msg.payload, now_s()))
+
+    def evict_stale(drain_lock):
+        cutoff = now_s() - DEVICE_TTL_S
+        stale = {dev for dev, ts in store["last_seen_by_device"].items() if ts < cutoff}
+        if not stale:
+            return
+        with drain_lock:
+            for key in ("metrics", "analysis", "explain", "lat_hist", "score_hist", "last_seen_by_device"):
+                for dev in stale:
+                    store[key].pop(dev, None)
+            store["devices"] = tuple(dev for dev in store["devices"] if dev not in stale)
+
+    def drain_inbox():
+        drain_lock = lock.gen_wlock()
+        next_evict = 0.0
+        while True:
+            if len(inbox) < INGEST_BATCH:
+                time.sleep(0.05)
+            if now_s() >= next_evict:
+                next_evict = now_s() + 60
+                evict_stale(drain_lock)
+            cutoff = now_s()
+            batch = [inbox.popleft() for _ in range(min(len(inbox), INGEST_BATCH))]
+            if len(batch) == INGEST_BATCH:
+                cutoff = batch[-1][2]
+            explain_batch = []
+            while explain_inbox and explain_inbox[0][2] <= cutoff:
+                explain_batch.append(explain_inbox.popleft())
+            if explain_batch:
+                batch = list(heapq.merge(batch, explain_batch, key=operator.itemgetter(2)))
+            if not batch:
+                continue
+
+            events = []
+            seen = {}
+            latest = {}
+            samples = []
+            for topic, raw, ts in batch:
+                try:
+                    try:
+                        payload = orjson.loads(raw)
+                    except orjson.JSONDecodeError:
+                        payload = json.loads(raw)
+                    device_id = sys.intern(str(payload.get("device_id", "unknown")))
+                    kind = topic_kind(topic)
+                    body = sample = None
+                    if kind is not None:
+                        body = payload if kind == "explain" else sub_dict(payload, kind)
+                        if kind in HISTORY_FIELDS:
+                            hist_key, field = HISTORY_FIELDS[kind]
+                            v = safe_num(body.get(field))
+                            if v is not None:
+                                sample = (hist_key, device_id, ts, v)
+                except (ValueError, AttributeError, TypeError, OverflowError):
+                    continue
+                events.append((ts, topic, device_id))
+                seen[device_id] = ts
+                if body is not None:
+                    latest[(kind, device_id)] = body
+                if sample is not None:
+                    samples.append(sample)
+
+            if not events:
+                continue
+
+            with drain_lock:
+                store["last_msg_ts"] = events[-1][0]
+                store["last_seen_by_device"].update(seen)
+                store["events"].extendleft(events)
+                new_devices = {device_id for _, device_id in latest}.difference(store["devices"])
+                if new_devices:
+                    store["devices"] = tuple(sorted(new_devices.union(store["devices"])))
+                for (kind, device_id), body in latest.items():
+                    store[kind][device_id] = body
+                for hist_key, device_id, ts, v in samples:
+                    ring = store[hist_key].get(device_id)
+                    if ring is None:
+                        ring = store[hist_key][device_id] = RingBuffer()
+                    ring.append(ts, v)
+
+    threading.Thread(target=drain_inbox, name="wmn-ingest", daemon=True).start()
 
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     if MQTT_USERNAME and MQTT_PASSWORD:
         client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
     client.tls_set()
-    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    client.reconnect_delay_set(min_delay=1, max_delay=4)
     client.on_connect = on_connect
     client.on_message = on_message
+    client.on_socket_open = lambda client, userdata, sock: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     try:
         client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_start()
-    except Exception:
+        threading.Thread(target=client.loop_forever, kwargs={"retry_first_connection": True}, name="wmn-mqtt", daemon=True).start()
+    except (ValueError, OSError):
         pass
 
     return store
@@ -189,127 +384,179 @@ with st.sidebar:
     z_thresh = st.slider("Z-threshold", 1.5, 6.0, 3.0, 0.1)
     min_samples = st.slider("Min samples", 10, 200, 30)
 
-def snapshot_devices():
-    lock = data.get("lock")
-    with lock:
-        devices = sorted(list(set(list(data["metrics"].keys()) + list(data["analysis"].keys()) + list(data["explain"].keys()))))
-        now_ts = now_s()
-        rows = []
-        for dev in devices:
-            mp = data["metrics"].get(dev, {})
-            mb = mp.get("metrics", {}) if isinstance(mp, dict) else {}
-            ap = data["analysis"].get(dev, {})
-            ab = ap.get("analysis", {}) if isinstance(ap, dict) else {}
-
-            rssi = safe_num(mb.get("rssi_dbm"))
-            lat = safe_num(mb.get("latency_ms_avg"))
-            jit = safe_num(mb.get("jitter_ms"))
-            loss = safe_num(mb.get("packet_loss_pct"))
-
-            analyzer_score = safe_num(ab.get("wireless_score_0_100"))
-            computed = compute_score(rssi, lat, jit, loss)
-            health = analyzer_score if analyzer_score is not None else computed
-
-            last_seen = data["last_seen_by_device"].get(dev)
-            age_s = None if not last_seen else int(now_ts - last_seen)
-            online = (age_s is not None and age_s <= online_grace_s)
-
-            iface = mb.get("interface")
-            chan = mb.get("channel")
-            handover = bool(ab.get("handover_detected"))
-            congestion = bool(ab.get("congestion_detected"))
-
-            rows.append(
-                {
-                    "device": dev,
-                    "online": online,
-                    "last_seen_s": age_s,
-                    "health": health,
-                    "rssi_dbm": rssi,
-                    "latency_ms": lat,
-                    "jitter_ms": jit,
-                    "loss_pct": loss,
-                    "handover": handover,
-                    "congestion": congestion,
-                    "interface": iface,
-                    "channel": chan,
-                }
-            )
-
-        df = pd.DataFrame(rows)
-        if not df.empty:
-            df = df.sort_values(by=["online", "health", "device"], ascending=[False, False, True])
-        return df
+alert_thresholds = {"rssi_dbm": rssi_bad, "latency_ms": lat_warn, "jitter_ms": jit_warn, "loss_pct": loss_warn}
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_fleet_df(last_msg_ts: float, devices: tuple, _metrics: dict, _analysis: dict, _last_seen: dict) -> pd.DataFrame:
+    mbs = [_metrics.get(dev, EMPTY) for dev in devices]
+    abs_ = [_analysis.get(dev, EMPTY) for dev in devices]
+    rssi = num_column(mbs, "rssi_dbm")
+    lat = num_column(mbs, "latency_ms_avg")
+    jit = num_column(mbs, "jitter_ms")
+    loss = num_column(mbs, "packet_loss_pct")
+    analyzer = num_column(abs_, "wireless_score_0_100")
+    health = np.where(np.isnan(analyzer), compute_scores(rssi, lat, jit, loss), analyzer)
+
+    return pd.DataFrame(
+        {
+            "device": np.array(devices, dtype=object),
+            "last_seen_ts": np.array([_last_seen.get(dev) for dev in devices], dtype=np.float64),
+            "health": health,
+            "rssi_dbm": rssi,
+            "latency_ms": lat,
+            "jitter_ms": jit,
+            "loss_pct": loss,
+            "handover": np.fromiter((bool(ab.get("handover_detected")) for ab in abs_), dtype=bool, count=len(abs_)),
+            "congestion": np.fromiter((bool(ab.get("congestion_detected")) for ab in abs_), dtype=bool, count=len(abs_)),
+            "interface": np.array([mb.get("interface") for mb in mbs], dtype=object),
+            "channel": np.array([mb.get("channel") for mb in mbs], dtype=object),
+        }
+    )
 
-def compute_latency_anomaly(dev: str):
-    hist = list(data["lat_hist"].get(dev, []))
-    if len(hist) < max(min_samples, z_window):
+def take_snapshot():
+    lock = data.get("lock")
+    with lock.gen_rlock():
+        return {
+            "metrics": dict(data["metrics"]),
+            "analysis": dict(data["analysis"]),
+            "explain": dict(data["explain"]),
+            "last_seen_by_device": dict(data["last_seen_by_device"]),
+            "devices": data["devices"],
+            "lat_seq": {dev: ring.seq for dev, ring in data["lat_hist"].items()},
+            "events": list(islice(data["events"], 200)),
+            "last_msg_ts": data["last_msg_ts"],
+            "connected": data["connected"],
+        }
+
+def snapshot_devices(snap: dict):
+    last_msg_ts = snap["last_msg_ts"]
+    devices = snap["devices"]
+    df = build_fleet_df(last_msg_ts, devices, snap["metrics"], snap["analysis"], snap["last_seen_by_device"])
+    if df.empty:
+        return df, (last_msg_ts, devices)
+
+    # Ages move with the wall clock, so they are derived outside the cached frame.
+    age_s = (now_s() - df.pop("last_seen_ts").to_numpy()).astype(np.int32)
+    online = age_s <= online_grace_s
+    df.insert(1, "online", online)
+    df.insert(2, "last_seen_s", age_s)
+    # Rows arrive sorted by device and lexsort is stable, so this matches
+    # sort_values(["online", "health", "device"], ascending=[False, False, True]).
+    return df.iloc[np.lexsort((-df["health"].to_numpy(), ~online))], (last_msg_ts, devices)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def fleet_arrow_table(last_msg_ts: float, devices: tuple, _df: pd.DataFrame) -> pa.Table:
+    _df = _df.sort_index()
+    health = _df["health"].to_numpy()
+    status = np.select([np.isnan(health), health >= 85, health >= 70], ["—", "OK", "WARN"], "BAD")
+    return pa.table({
+        "device": pa.array(_df["device"].to_numpy(), type=pa.string()),
+        "health": pa.array(health, type=pa.float64(), from_pandas=True),
+        "status": pa.array(status).dictionary_encode(),
+        **{c: pa.array(_df[c].to_numpy(), type=pa.float64(), from_pandas=True) for c in ("rssi_dbm", "latency_ms", "jitter_ms", "loss_pct")},
+        "handover": pa.array(_df["handover"].to_numpy()),
+        "congestion": pa.array(_df["congestion"].to_numpy()),
+        **{c: pa.array([None if x is None else str(x) for x in _df[c]], type=pa.string()).dictionary_encode() for c in ("interface", "channel")},
+    })
+
+def history_tail(kind: str, dev: str, k: int):
+    lock = data.get("lock")
+    with lock.gen_rlock():
+        ring = data[kind].get(dev)
+        if ring is None:
+            return np.empty(0), np.empty(0)
+        return ring.tail(k)
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def latency_heatmap_table(dev_seqs: tuple) -> pa.Table:
+    idx, ts, lats = [], [], []
+    lock = data.get("lock")
+    with lock.gen_rlock():
+        for i, (dev, _) in enumerate(dev_seqs):
+            ring = data["lat_hist"].get(dev)
+            if ring is None or len(ring) < 5:
+                continue
+            t, v = ring.tail(60)
+            idx.append(np.full(len(v), i))
+            ts.append(t)
+            lats.append(v)
+    if not idx:
+        return pa.table({"device": pa.array([], pa.string()), "minute": pa.array([], pa.timestamp("s", tz="UTC")), "lat": pa.array([], pa.float64())})
+    keys, inv = np.unique(np.stack((np.concatenate(idx), np.concatenate(ts) // 60 * 60)), axis=1, return_inverse=True)
+    inv = inv.ravel()
+    names = np.array([dev for dev, _ in dev_seqs], dtype=object)
+    return pa.table({
+        "device": pa.array(names[keys[0].astype(np.intp)], pa.string()),
+        "minute": pa.array(keys[1].astype(np.int64), pa.int64()).cast(pa.timestamp("s", tz="UTC")),
+        "lat": np.bincount(inv, weights=np.concatenate(lats)) / np.bincount(inv),
+    })
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def latency_zscore(dev: str, seq: int, window: int, min_n: int):
+    _, v = history_tail("lat_hist", dev, max(min_n, window))
+    if len(v) < max(min_n, window):
         return None
-    df = pd.DataFrame(hist).sort_values("t")
-    df["mu"] = df["lat"].rolling(z_window, min_periods=z_window).mean()
-    df["sd"] = df["lat"].rolling(z_window, min_periods=z_window).std()
-    last = df.iloc[-1]
-    if pd.isna(last["mu"]) or pd.isna(last["sd"]) or float(last["sd"]) == 0.0:
+    win = v[-window:].astype(np.float64)
+    sd = win.std(ddof=1)
+    if not np.isfinite(sd) or sd == 0.0:
         return None
-    z = (float(last["lat"]) - float(last["mu"])) / float(last["sd"])
-    return float(z)
+    return float((win[-1] - win.mean()) / sd)
+
+def compute_latency_anomaly(dev: str):
+    return latency_zscore(dev, snap["lat_seq"].get(dev, 0), z_window, min_samples)
 
 def build_incidents(df_devices: pd.DataFrame):
-    incidents = []
-    ts = pd.Timestamp.utcnow()
+    if df_devices.empty:
+        return pd.DataFrame(columns=["ts", "device", "sev", "type", "detail"])
 
-    for _, r in df_devices.iterrows():
-        dev = r["device"]
-        if r["online"] is False:
-            incidents.append({"ts": ts, "device": dev, "sev": "bad", "type": "offline", "detail": f"Last seen {r['last_seen_s']}s ago"})
-            continue
+    ts = pd.Timestamp(now_s(), unit="s", tz="UTC")
+    devices = df_devices["device"].to_numpy()
+    online = df_devices["online"].to_numpy()
+    row = np.arange(len(devices))
+    parts = []
+
+    def add(mask, sev, kind, detail):
+        if mask.any():
+            parts.append(pd.DataFrame({"row": row[mask], "device": devices[mask], "sev": sev, "type": kind, "detail": detail}))
+
+    offline = ~online
+    add(offline, "bad", "offline", np.char.mod("Last seen %ds ago", df_devices["last_seen_s"].to_numpy()[offline]))
+
+    for kind, col, op, bad_factor, _, detail_fmt in ALERT_RULES:
+        v = df_devices[col].to_numpy()
+        hit = online & CMP[op](v, alert_thresholds[col])
+        sev = np.where(CMP[op](v[hit], alert_thresholds[col] * bad_factor), "bad", "warn") if bad_factor is not None else "warn"
+        add(hit, sev, kind, np.char.mod(detail_fmt, v[hit]))
 
-        rssi = r["rssi_dbm"]
-        lat = r["latency_ms"]
-        jit = r["jitter_ms"]
-        loss = r["loss_pct"]
-
-        if rssi is not None and rssi < rssi_bad:
-            incidents.append({"ts": ts, "device": dev, "sev": "warn", "type": "weak_signal", "detail": f"RSSI {rssi:.0f} dBm"})
-        if lat is not None and lat > lat_warn:
-            sev = "bad" if lat > (lat_warn * 1.6) else "warn"
-            incidents.append({"ts": ts, "device": dev, "sev": sev, "type": "high_latency", "detail": f"Latency {lat:.1f} ms"})
-        if jit is not None and jit > jit_warn:
-            sev = "bad" if jit > (jit_warn * 1.6) else "warn"
-            incidents.append({"ts": ts, "device": dev, "sev": sev, "type": "high_jitter", "detail": f"Jitter {jit:.1f} ms"})
-        if loss is not None and loss > loss_warn:
-            sev = "bad" if loss > (loss_warn * 2.0) else "warn"
-            incidents.append({"ts": ts, "device": dev, "sev": sev, "type": "packet_loss", "detail": f"Loss {loss:.2f}%"})
-
-        if bool(r["handover"]):
-            incidents.append({"ts": ts, "device": dev, "sev": "warn", "type": "handover", "detail": "Roam/handover detected"})
-        if bool(r["congestion"]):
-            incidents.append({"ts": ts, "device": dev, "sev": "warn", "type": "congestion", "detail": "Congestion flagged"})
-
-        z = compute_latency_anomaly(dev)
-        if z is not None and abs(z) >= z_thresh:
-            sev = "bad" if abs(z) >= (z_thresh * 1.35) else "warn"
-            incidents.append({"ts": ts, "device": dev, "sev": sev, "type": "latency_anomaly", "detail": f"Latency anomaly z={z:.2f}"})
-
-    if not incidents:
+    add(online & df_devices["handover"].to_numpy(), "warn", "handover", "Roam/handover detected")
+    add(online & df_devices["congestion"].to_numpy(), "warn", "congestion", "Congestion flagged")
+
+    z = np.array([compute_latency_anomaly(dev) if on else None for dev, on in zip(devices, online)], dtype=np.float64)
+    hit = np.abs(z) >= z_thresh
+    add(hit, np.where(np.abs(z[hit]) >= z_thresh * 1.35, "bad", "warn"), "latency_anomaly", np.char.mod("Latency anomaly z=%.2f", z[hit]))
+
+    if not parts:
         return pd.DataFrame(columns=["ts", "device", "sev", "type", "detail"])
 
-    df_i = pd.DataFrame(incidents)
-    df_i = df_i.sort_values(by=["sev", "ts"], ascending=[True, False])
-    return df_i
+    df_i = pd.concat(parts, ignore_index=True)
+    df_i.insert(0, "ts", ts)
+    # stable on (sev, fleet row) keeps the per-device rule order within each severity
+    return df_i.sort_values(by=["sev", "row"], kind="stable").drop(columns="row")
 
-df_devices = snapshot_devices()
+snap = take_snapshot()
+df_devices, fleet_version = snapshot_devices(snap)
+df_inc = build_incidents(df_devices)
 
 age = None
-if data.get("last_msg_ts", 0):
-    age = int(now_s() - data["last_msg_ts"])
+if snap["last_msg_ts"]:
+    age = int(now_s() - snap["last_msg_ts"])
 
 b1, b2, b3 = st.columns([1, 1, 2])
 
 with b1:
     st.markdown(
-        f'<span class="badge"><span class="dot {"ok" if data.get("connected") else "warn"}"></span>'
-        f'Broker: {"Connected" if data.get("connected") else "Connecting"}'
+        f'<span class="badge"><span class="dot {"ok" if snap["connected"] else "warn"}"></span>'
+        f'Broker: {"Connected" if snap["connected"] else "Connecting"}'
         f"</span>",
         unsafe_allow_html=True,
     )
@@ -347,23 +594,28 @@ with tab_fleet:
         worst_dev = worst["device"].iloc[0] if not worst.empty else "—"
         worst_score = worst["health"].iloc[0] if not worst.empty else None
 
-        df_inc = build_incidents(df_devices)
         active_cnt = int(len(df_inc))
 
-        k1, k2, k3, k4 = st.columns(4)
-        k1.markdown(f'<div class="kpi"><div class="l">Online devices</div><div class="v">{int(df_devices["online"].sum())}/{len(df_devices)}</div><div class="h">Heartbeat ≤ {online_grace_s}s</div></div>', unsafe_allow_html=True)
-        k2.markdown(f'<div class="kpi"><div class="l">Avg health</div><div class="v">{("—" if avg_health is None else f"{avg_health:.0f}")}</div><div class="h">Analyzer or fallback score</div></div>', unsafe_allow_html=True)
-        k3.markdown(f'<div class="kpi"><div class="l">Worst device</div><div class="v">{worst_dev}</div><div class="h">Score {("—" if worst_score is None else int(worst_score))}</div></div>', unsafe_allow_html=True)
-        k4.markdown(f'<div class="kpi"><div class="l">Active incidents</div><div class="v">{active_cnt}</div><div class="h">Rules + anomaly detection</div></div>', unsafe_allow_html=True)
+        st.markdown(
+            '<div class="kpis">'
+            + kpi_html("Online devices", f'{int(df_devices["online"].sum())}/{len(df_devices)}', f"Heartbeat ≤ {online_grace_s}s")
+            + kpi_html("Avg health", "—" if avg_health is None else f"{avg_health:.0f}", "Analyzer or fallback score")
+            + kpi_html("Worst device", str(worst_dev), f'Score {("—" if worst_score is None else int(worst_score))}')
+            + kpi_html("Active incidents", str(active_cnt), "Rules + anomaly detection")
+            + "</div>",
+            unsafe_allow_html=True,
+        )
 
         st.markdown('<div class="section">Fleet Table</div>', unsafe_allow_html=True)
 
-        df_show = df_devices.copy()
-        df_show["sev"] = df_show["health"].apply(sev_from_score)
-        df_show["status"] = df_show["sev"].apply(lambda x: "OK" if x == "ok" else "WARN" if x == "warn" else "BAD" if x == "bad" else "—")
+        fleet_table = fleet_arrow_table(*fleet_version, _df=df_devices).take(df_devices.index.to_numpy())
+        fleet_table = fleet_table.add_column(1, "online", pa.array(df_devices["online"].to_numpy()))
+        fleet_table = fleet_table.add_column(2, "last_seen_s", pa.array(df_devices["last_seen_s"].to_numpy()))
+        alert_counts = df_inc["device"].value_counts().reindex(df_devices["device"], fill_value=0)
+        fleet_table = fleet_table.add_column(5, "alerts", pa.array(alert_counts.to_numpy(), type=pa.int32()))
 
         st.dataframe(
-            df_show[["device", "online", "last_seen_s", "health", "status", "rssi_dbm", "latency_ms", "jitter_ms", "loss_pct", "handover", "congestion", "interface", "channel"]],
+            fleet_table,
             width="stretch",
             hide_index=True,
             column_config={
@@ -372,6 +624,7 @@ with tab_fleet:
                 "last_seen_s": st.column_config.NumberColumn("Last seen (s)", format="%.0f"),
                 "health": st.column_config.NumberColumn("Health (0-100)", format="%.0f"),
                 "status": st.column_config.TextColumn("Status"),
+                "alerts": st.column_config.NumberColumn("Alerts", format="%d"),
                 "rssi_dbm": st.column_config.NumberColumn("RSSI (dBm)", format="%.0f"),
                 "latency_ms": st.column_config.NumberColumn("Latency (ms)", format="%.1f"),
                 "jitter_ms": st.column_config.NumberColumn("Jitter (ms)", format="%.1f"),
@@ -386,39 +639,17 @@ with tab_fleet:
         c1, c2 = st.columns([1, 1])
 
         with c1:
-            dist = df_devices.dropna(subset=["health"])[["device", "health"]]
-            if not dist.empty:
-                chart = alt.Chart(dist).mark_bar(opacity=0.85).encode(
-                    x=alt.X("health:Q", bin=alt.Bin(maxbins=20), title="Health (0-100)"),
-                    y=alt.Y("count():Q", title="Devices"),
-                    tooltip=[alt.Tooltip("count():Q", title="Devices")],
-                ).properties(height=250)
-                st.altair_chart(chart, use_container_width=True)
+            health = df_devices["health"].to_numpy()
+            health = health[~np.isnan(health)]
+            if health.size:
+                st.vega_lite_chart(pa.table({"health": health}), health_hist_spec(), use_container_width=True)
             else:
                 st.info("No health scores yet.")
 
         with c2:
-            heat_rows = []
-            for dev in df_devices["device"].tolist():
-                hist = list(data["lat_hist"].get(dev, []))
-                if len(hist) < 5:
-                    continue
-                dfh = pd.DataFrame(hist).sort_values("t").tail(60)
-                if dfh.empty:
-                    continue
-                dfh["minute"] = dfh["t"].dt.floor("min")
-                agg = dfh.groupby("minute", as_index=False)["lat"].mean()
-                for _, rr in agg.iterrows():
-                    heat_rows.append({"device": dev, "minute": rr["minute"], "lat": float(rr["lat"])})
-            if heat_rows:
-                df_heat = pd.DataFrame(heat_rows)
-                heat = alt.Chart(df_heat).mark_rect().encode(
-                    x=alt.X("minute:T", title="Time"),
-                    y=alt.Y("device:N", title="Device"),
-                    color=alt.Color("lat:Q", title="Latency (ms)"),
-                    tooltip=[alt.Tooltip("device:N"), alt.Tooltip("minute:T"), alt.Tooltip("lat:Q", format=".1f")],
-                ).properties(height=250)
-                st.altair_chart(heat, use_container_width=True)
+            heat = latency_heatmap_table(tuple((dev, snap["lat_seq"].get(dev, 0)) for dev in df_devices["device"]))
+            if heat.num_rows:
+                st.vega_lite_chart(heat, heatmap_spec(), use_container_width=True)
             else:
                 st.info("Not enough latency samples for heatmap.")
 
@@ -430,34 +661,30 @@ with tab_device:
             st.session_state.selected_device = df_devices["device"].iloc[0]
 
         devices = df_devices["device"].tolist()
+        device_pos = {d: i for i, d in enumerate(devices)}
         st.session_state.selected_device = st.selectbox(
             "Inspect device",
             devices,
-            index=devices.index(st.session_state.selected_device)
-            if st.session_state.selected_device in devices
-            else 0,
+            index=device_pos.get(st.session_state.selected_device, 0),
         )
         dev = st.session_state.selected_device
 
         # Clear previous diagnostic if device changed
         if st.session_state.get("qa_device") != dev:
             st.session_state.qa_last = None
+            st.session_state.qa_future = None
             st.session_state.qa_device = dev
 
-        row = df_devices[df_devices["device"] == dev].head(1)
-        mp = data["metrics"].get(dev, {})
-        ap = data["analysis"].get(dev, {})
-        ep = data["explain"].get(dev, {})
-
-        m = mp.get("metrics", {}) if isinstance(mp, dict) else {}
-        a = ap.get("analysis", {}) if isinstance(ap, dict) else {}
+        row = df_devices.iloc[[device_pos[dev]]]
+        m = snap["metrics"].get(dev, EMPTY)
+        a = snap["analysis"].get(dev, EMPTY)
+        ep = snap["explain"].get(dev, {})
 
         rssi = safe_num(m.get("rssi_dbm"))
         lat = safe_num(m.get("latency_ms_avg"))
         jit = safe_num(m.get("jitter_ms"))
         loss = safe_num(m.get("packet_loss_pct"))
-        analyzer_score = safe_num(a.get("wireless_score_0_100"))
-        health = analyzer_score if analyzer_score is not None else compute_score(rssi, lat, jit, loss)
+        health = None if row.empty or pd.isna(row["health"].iloc[0]) else float(row["health"].iloc[0])
 
         online = bool(row["online"].iloc[0]) if not row.empty else False
         last_seen = row["last_seen_s"].iloc[0] if not row.empty else None
@@ -465,25 +692,23 @@ with tab_device:
 
         st.markdown('<div class="section">Device Summary</div>', unsafe_allow_html=True)
 
-        kk1, kk2, kk3, kk4 = st.columns(4)
-        kk1.markdown(f'<div class="kpi"><div class="l">Status</div><div class="v">{("ONLINE" if online else "OFFLINE")}</div><div class="h">Last seen {("—" if last_seen is None else str(int(last_seen))+"s")}</div></div>', unsafe_allow_html=True)
-        kk2.markdown(f'<div class="kpi"><div class="l">Health</div><div class="v">{("—" if health is None else int(health))}</div><div class="h">Analyzer or fallback</div></div>', unsafe_allow_html=True)
-        kk3.markdown(f'<div class="kpi"><div class="l">RSSI</div><div class="v">{("—" if rssi is None else f"{rssi:.0f} dBm")}</div><div class="h">Threshold bad < {rssi_bad} dBm</div></div>', unsafe_allow_html=True)
-        kk4.markdown(f'<div class="kpi"><div class="l">Latency</div><div class="v">{("—" if lat is None else f"{lat:.1f} ms")}</div><div class="h">Warn > {lat_warn} ms</div></div>', unsafe_allow_html=True)
+        st.markdown(
+            '<div class="kpis">'
+            + kpi_html("Status", "ONLINE" if online else "OFFLINE", f'Last seen {("—" if last_seen is None else str(int(last_seen))+"s")}')
+            + kpi_html("Health", "—" if health is None else str(int(health)), "Analyzer or fallback")
+            + kpi_html("RSSI", "—" if rssi is None else f"{rssi:.0f} dBm", f"Threshold bad < {rssi_bad} dBm")
+            + kpi_html("Latency", "—" if lat is None else f"{lat:.1f} ms", f"Warn > {lat_warn} ms")
+            + "</div>",
+            unsafe_allow_html=True,
+        )
 
         st.markdown('<div class="section">Alerts</div>', unsafe_allow_html=True)
 
         alerts = []
         if not online:
             alerts.append(("bad", "Device offline"))
-        if rssi is not None and rssi < rssi_bad:
-            alerts.append(("warn", f"Weak signal: RSSI {rssi:.0f} dBm"))
-        if lat is not None and lat > lat_warn:
-            alerts.append(("bad" if lat > lat_warn * 1.6 else "warn", f"High latency: {lat:.1f} ms"))
-        if jit is not None and jit > jit_warn:
-            alerts.append(("bad" if jit > jit_warn * 1.6 else "warn", f"High jitter: {jit:.1f} ms"))
-        if loss is not None and loss > loss_warn:
-            alerts.append(("bad" if loss > loss_warn * 2 else "warn", f"Packet loss: {loss:.2f}%"))
+        values = {"rssi_dbm": rssi, "latency_ms": lat, "jitter_ms": jit, "loss_pct": loss}
+        alerts.extend((sev, text) for sev, _, text, _ in match_alert_rules(values, alert_thresholds))
         if bool(a.get("handover_detected")):
             alerts.append(("warn", "Handover detected"))
         if bool(a.get("congestion_detected")):
@@ -499,7 +724,7 @@ with tab_device:
         st.markdown('<div class="section">Automatic Explanation</div>', unsafe_allow_html=True)
 
         if ep:
-            txt = ep.get("text") or ep.get("explanation") or json.dumps(ep, indent=2)
+            txt = ep.get("text") or ep.get("explanation") or orjson.dumps(ep, option=orjson.OPT_INDENT_2).decode()
             st.markdown(f'<div class="card">{txt}</div>', unsafe_allow_html=True)
         else:
             st.markdown('<div class="card"><span class="small">No automatic explanation received.</span></div>', unsafe_allow_html=True)
@@ -543,23 +768,27 @@ Operational Impact:
 Recommended Action:
 """
 
+            st.session_state.qa_future = http_executor().submit(
+                http_post_json,
+                f"{EXPLAINER_HTTP_BASE}/explain",
+                {
+                    "analysis": {
+                        "device_id": dev,
+                        "raw": dict(m),
+                        "analysis": {
+                            **a,
+                            "_diagnostic_instruction": instruction_block
+                        }
+                    }
+                },
+                timeout_s=30,
+            )
+
+        qa_future = st.session_state.get("qa_future")
+        if qa_future is not None and qa_future.done():
+            st.session_state.qa_future = None
             try:
-                with st.spinner("Running structured diagnostic..."):
-
-                    status, data_json, err = http_post_json(
-                        f"{EXPLAINER_HTTP_BASE}/explain",
-                        {
-                            "analysis": {
-                                "device_id": dev,
-                                "raw": m,
-                                "analysis": {
-                                    **a,
-                                    "_diagnostic_instruction": instruction_block
-                                }
-                            }
-                        },
-                        timeout_s=30,
-                    )
+                status, data_json, err = qa_future.result()
 
                 if data_json is not None:
                     st.session_state.qa_last = data_json
@@ -571,6 +800,8 @@ Recommended Action:
 
             except Exception as e:
                 st.session_state.qa_last = {"error": str(e)}
+        elif qa_future is not None:
+            st.info("Running structured diagnostic...")
 
         if st.session_state.qa_last:
             answer = (
@@ -581,12 +812,15 @@ Recommended Action:
             if answer:
                 st.markdown(f'<div class="card">{answer}</div>', unsafe_allow_html=True)
             else:
-                st.json(st.session_state.qa_last)
+                raw = orjson.dumps(st.session_state.qa_last, option=orjson.OPT_INDENT_2).decode()
+                if len(raw) > QA_PREVIEW_CHARS:
+                    raw = raw[:QA_PREVIEW_CHARS] + "\n... [truncated]"
+                st.code(raw, language="json")
 
         if debug_mode:
             with st.expander("Debug payloads"):
-                st.json(mp)
-                st.json(ap)
+                st.json(dict(m))
+                st.json(dict(a))
                 st.json(ep)
 
 
@@ -597,8 +831,6 @@ with tab_incidents:
     if df_devices.empty:
         st.info("Awaiting telemetry...")
     else:
-        df_inc = build_incidents(df_devices)
-
         if df_inc.empty:
             st.success("No active incidents.")
         else:
@@ -615,30 +847,18 @@ with tab_incidents:
             b1, b2 = st.columns([1, 1])
             with b1:
                 by_type = view.groupby("type", as_index=False).size()
-                chart = alt.Chart(by_type).mark_bar(opacity=0.85).encode(
-                    x=alt.X("size:Q", title="Count"),
-                    y=alt.Y("type:N", sort="-x", title=""),
-                    tooltip=[alt.Tooltip("type:N"), alt.Tooltip("size:Q")],
-                ).properties(height=260)
-                st.altair_chart(chart, use_container_width=True)
+                st.vega_lite_chart(by_type, count_bar_spec("type"), use_container_width=True)
             with b2:
                 by_dev = view.groupby("device", as_index=False).size().sort_values("size", ascending=False).head(12)
-                chart = alt.Chart(by_dev).mark_bar(opacity=0.85).encode(
-                    x=alt.X("size:Q", title="Count"),
-                    y=alt.Y("device:N", sort="-x", title=""),
-                    tooltip=[alt.Tooltip("device:N"), alt.Tooltip("size:Q")],
-                ).properties(height=260)
-                st.altair_chart(chart, use_container_width=True)
+                st.vega_lite_chart(by_dev, count_bar_spec("device"), use_container_width=True)
 
 with tab_ops:
     st.markdown('<div class="section">Ingest & Event Stream</div>', unsafe_allow_html=True)
 
-    lock = data.get("lock")
-    with lock:
-        events = list(data["events"])[:200]
-
+    events = snap["events"]
     if events:
-        df_e = pd.DataFrame(events)
+        df_e = pd.DataFrame(events, columns=["ts", "topic", "device"])
+        df_e["ts"] = pd.to_datetime(df_e["ts"], unit="s", utc=True)
         st.dataframe(df_e, width="stretch", hide_index=True)
     else:
         st.info("No events yet.")
@@ -646,9 +866,9 @@ with tab_ops:
     st.markdown('<div class="section">Data Retention</div>', unsafe_allow_html=True)
     st.markdown(
         f'<div class="card"><div class="small">Latency samples per device</div>'
-        f'<div style="font-size:22px;font-weight:800">{1200}</div>'
+        f'<div style="font-size:22px;font-weight:800">{HIST_LEN}</div>'
         f'<div class="small">Score samples per device</div>'
-        f'<div style="font-size:22px;font-weight:800">{1200}</div></div>',
+        f'<div style="font-size:22px;font-weight:800">{HIST_LEN}</div></div>',
         unsafe_allow_html=True,
     )
 
@@ -662,7 +882,17 @@ with tab_ops:
         unsafe_allow_html=True,
     )
 
-should_refresh = (not pause_refresh) and (now_s() >= st.session_state.get("qa_lock_until", 0.0))
-if should_refresh:
-    time.sleep(refresh_sec)
-    st.rerun()
+if st.session_state.get("qa_device") not in snap["devices"]:
+    # the device left the fleet (evicted or empty) before its diagnostic was consumed
+    st.session_state.qa_future = None
+
+if st.session_state.get("qa_future") is not None:
+    # poll for the pending diagnostic even while refresh is paused
+    st_autorefresh(interval=1000, key="poll")
+elif not pause_refresh:
+    idle = snap["last_msg_ts"] == st.session_state.get("rendered_ts")
+    st.session_state.rendered_ts = snap["last_msg_ts"]
+    # back off while nothing arrives, but still catch devices crossing the online grace
+    poll_s = min(st.session_state.get("poll_s", refresh_sec) * 2, max(refresh_sec, online_grace_s)) if idle else refresh_sec
+    st.session_state.poll_s = poll_s
+    st_autorefresh(interval=int(poll_s * 1000), key="poll")
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+from streamlit.testing.v1 import AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+FRAMES = [
+    ("wmn/metrics/dev-big", b'{"device_id":"dev-big","metrics":{"latency_ms_avg":1' + b"0" * 400 + b',"rssi_dbm":-60}}'),
+    ("wmn/metrics/dev-nan", b'{"device_id":"dev-nan","metrics":{"latency_ms_avg":NaN,"rssi_dbm":-70}}'),
+    ("wmn/metrics/dev-inf", b'{"device_id":"dev-inf","metrics":{"latency_ms_avg":Infinity,"jitter_ms":-Infinity}}'),
+    ("wmn/metrics/dev-ok", b'{"device_id":"dev-ok","metrics":{"latency_ms_avg":42.5,"rssi_dbm":-55}}'),
+]
+
+
+class FakeClient:
+    def __init__(self, *args, **kwargs):
+        self.on_connect = None
+        self.on_message = None
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def loop_forever(self, *args, **kwargs):
+        self.on_connect(self, None, {}, 0, None)
+        for topic, payload in FRAMES:
+            self.on_message(self, None, SimpleNamespace(topic=topic, payload=payload))
+        threading.Event().wait()
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self._client = mqtt.Client
+        self._broker = os.environ.get("MQTT_BROKER")
+        mqtt.Client = FakeClient
+        os.environ["MQTT_BROKER"] = "127.0.0.1"
+
+    def tearDown(self):
+        mqtt.Client = self._client
+        if self._broker is None:
+            os.environ.pop("MQTT_BROKER", None)
+        else:
+            os.environ["MQTT_BROKER"] = self._broker
+
+    def test_non_finite_and_oversized_numbers_are_missing(self):
+        at = AppTest.from_file(APP, default_timeout=60)
+        at.run()
+        time.sleep(0.5)
+        at.run()
+        self.assertFalse(at.exception)
+
+        fleet = at.dataframe[0].value.set_index("device")
+        self.assertEqual(set(fleet.index), {"dev-big", "dev-nan", "dev-inf", "dev-ok"})
+        self.assertTrue(fleet.loc[["dev-big", "dev-nan", "dev-inf"], "latency_ms"].isna().all())
+        self.assertTrue(fleet.loc[["dev-inf"], "jitter_ms"].isna().all())
+        self.assertEqual(fleet.loc["dev-ok", "latency_ms"], 42.5)
+
+
+if __name__ == "__main__":
+    unittest.main()